@@ -1,6 +1,13 @@
 import os
 import uvicorn
-from app.api import app
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=os.getenv("PORT", 8001))
+    # Import string (not the app object) so uvicorn can spawn multiple workers
+    uvicorn.run(
+        "app.api:app",
+        host="0.0.0.0",
+        port=int(os.getenv("PORT", "8001")),
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.getenv("WORKERS", "1")),
+    )
@@ -1,16 +1,33 @@
+import os
 import time
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
+from fastapi.responses import ORJSONResponse
 from app.routers import router
+from app.subtensor_manager import SubtensorManager
 
 
-app = FastAPI(title="TaoWidget API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Share one manager (and its websocket) across all requests
+    app.state.subtensor_manager = SubtensorManager()
+    yield
+    await app.state.subtensor_manager.close()
+
+
+app = FastAPI(title="TaoWidget API", lifespan=lifespan, default_response_class=ORJSONResponse)
 
-@app.middleware("http")
 async def add_process_time_header(request: Request, call_next):
-    start_time = time.perf_counter()
+    start_time = time.monotonic_ns()
     response = await call_next(request)
-    process_time = time.perf_counter() - start_time
-    response.headers["X-Process-Time"] = str(process_time)
+    process_time = time.monotonic_ns() - start_time
+    response.headers["X-Process-Time"] = f"{process_time / 1e9:.6f}"
     return response
 
+
+# The extra ASGI frame costs on every request, so only register the
+# middleware when timing is actually wanted
+if os.getenv("EXPOSE_TIMING"):
+    app.middleware("http")(add_process_time_header)
+
 app.include_router(router)
@@ -1,15 +1,23 @@
-from datetime import datetime, timedelta
-from fastapi import APIRouter, Depends, Query, Response
+from datetime import date, datetime, time, timedelta
+from fastapi import APIRouter, Depends, Query, Request, Response
 from fastapi.responses import StreamingResponse
 from typing import List, Dict
 import asyncio
+import os
+import matplotlib
+matplotlib.use('Agg')  # headless backend; rendering runs outside the event loop
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
+import numpy as np
+import functools
+import hashlib
 import io
 import re
+import threading
 from app.models import DailyData, HistoricalData
 from app.subtensor_manager import SubtensorManager, get_subtensor_manager
-from collections import defaultdict
+from collections import OrderedDict
+from cachetools import TTLCache
 
 router = APIRouter(prefix="/api/v1", tags=["historical"])
 
@@ -18,74 +26,164 @@ plt.style.use('dark_background')
 
 BLOCKS_PER_DAY = 7200
 
+# Opt-in batched storage reads; some RPC providers meter batches per sub-call,
+# so this stays off unless explicitly enabled.
+BATCH_RPC = os.getenv("SUBTENSOR_BATCH_RPC") == "1"
 
+# Rendered chart PNGs, keyed on (coldkey, days); the data has daily
+# granularity, so a short TTL is invisible to users.
+CHART_CACHE_TTL = 90
+_CHART_CACHE: TTLCache = TTLCache(maxsize=256, ttl=CHART_CACHE_TTL)
+
+# Finalized block hashes are immutable, so entries never need invalidation;
+# the cache is only bounded to cap memory.
+_BLOCK_HASH_CACHE: OrderedDict[int, str] = OrderedDict()
+_BLOCK_HASH_CACHE_SIZE = 4096
+
+
+async def _get_block_hash(substrate, block: int) -> str:
+    if block in _BLOCK_HASH_CACHE:
+        _BLOCK_HASH_CACHE.move_to_end(block)
+        return _BLOCK_HASH_CACHE[block]
+    block_hash = await substrate.get_block_hash(block)
+    _BLOCK_HASH_CACHE[block] = block_hash
+    if len(_BLOCK_HASH_CACHE) > _BLOCK_HASH_CACHE_SIZE:
+        _BLOCK_HASH_CACHE.popitem(last=False)
+    return block_hash
+
+
+def _make_etag(*parts) -> str:
+    # Stable per calendar day, so polling clients get 304s between updates.
+    # RFC 9110 entity-tags are quoted strings.
+    digest = hashlib.blake2b(":".join(str(part) for part in parts).encode(), digest_size=16).hexdigest()
+    return f'"{digest}"'
+
+
+def _etag_matches(header: str | None, etag: str) -> bool:
+    # If-None-Match may carry a comma-separated list, weak W/ prefixes, or *
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    candidates = (tag.strip() for tag in header.split(','))
+    return any(tag.removeprefix('W/') == etag for tag in candidates)
+
+
+_ADDR_STRIP = re.compile(r'^[^a-zA-Z0-9]+|[^a-zA-Z0-9]+$')
+
+
+@functools.lru_cache(maxsize=1024)
 def shorten_address(address: str) -> str:
     # Remove any non-alphanumeric characters from the start and end
-    clean_address = re.sub(r'^[^a-zA-Z0-9]+|[^a-zA-Z0-9]+$', '', address)
+    clean_address = _ADDR_STRIP.sub('', address)
     if len(clean_address) <= 12:
         return clean_address
     return f"{clean_address[:6]}...{clean_address[-6:]}"
 
 
-async def _get_balance_at_block(substrate, coldkey: str, block: int) -> tuple[int, datetime, float]:
+def _block_timestamps(blocks, current_block: int) -> list[datetime]:
+    # One clock read per request keeps the series internally consistent
+    now = datetime.now()
+    return [now - timedelta(days=(current_block - block) // BLOCKS_PER_DAY) for block in blocks]
+
+
+async def _get_balance_at_block(substrate, coldkey: str, block: int, timestamp: datetime) -> tuple[int, datetime, float]:
     # Query the System.Account storage for the balance
     result = await substrate.query(
         module='System',
         storage_function='Account',
         params=[coldkey],
-        block_hash=await substrate.get_block_hash(block)
+        block_hash=await _get_block_hash(substrate, block)
     )
     balance = result["data"]["free"] / 1e9
-    timestamp = datetime.now() - timedelta(days=(await substrate.get_block_number() - block) // BLOCKS_PER_DAY)
     return block, timestamp, balance
 
 
-async def _get_stake_at_block(substrate, coldkey: str, block: int) -> tuple[int, datetime, float]:
+async def _get_balances_batched(substrate, coldkey: str, blocks, timestamps: list[datetime]) -> list[tuple[int, datetime, float]]:
+    # Encode the System.Account storage key once and reuse it for every block,
+    # fetching each point through the query_multi batched-storage API
+    storage_key = await substrate.create_storage_key('System', 'Account', [coldkey])
+    block_hashes = await asyncio.gather(*[_get_block_hash(substrate, block) for block in blocks])
+    responses = await asyncio.gather(
+        *[substrate.query_multi([storage_key], block_hash=block_hash) for block_hash in block_hashes],
+        return_exceptions=True
+    )
+
+    results = []
+    for block, timestamp, response in zip(blocks, timestamps, responses):
+        if isinstance(response, Exception):
+            continue
+        _, account = response[0]
+        if account is None:
+            continue
+        balance = account["data"]["free"] / 1e9
+        results.append((block, timestamp, balance))
+    return results
+
+
+async def _get_stake_at_block(substrate, coldkey: str, block: int, timestamp: datetime) -> tuple[int, datetime, float]:
     # Query the runtime API for stake information
     result = await substrate.runtime_call(
         api="StakeInfoRuntimeApi",
         method="get_stake_info_for_coldkey",
         params=[coldkey],
-        block_hash=await substrate.get_block_hash(block)
+        block_hash=await _get_block_hash(substrate, block)
     )
-    
+
     if result.value is None:
-        return block, datetime.now(), 0.0
-        
+        return block, timestamp, 0.0
+
     # Sum up all stakes
-    total_stake = sum(stake['stake'] for stake in result.value if stake['stake'] > 0)
+    total_stake = sum(s['stake'] for s in result.value if s['stake'] > 0)
     stake = total_stake / 1e9  # Convert from Planck to Tao
-    
-    timestamp = datetime.now() - timedelta(days=(await substrate.get_block_number() - block) // BLOCKS_PER_DAY)
+
     return block, timestamp, stake
 
 
 @router.get("/balance/{coldkey}", response_model=List[HistoricalData])
 async def get_historical_balance(
     coldkey: str,
+    request: Request,
+    response: Response,
     days: int = Query(default=7, description="Number of days to look back"),
     subtensor_manager: SubtensorManager = Depends(get_subtensor_manager)
 ) -> List[HistoricalData]:
     total_blocks = days * BLOCKS_PER_DAY
-    
+
     async with subtensor_manager.get_subtensor() as substrate:
         current_block = await substrate.get_block_number()
+
+        # Answer unchanged polls with a 304 before doing the fan-out
+        etag = _make_etag(coldkey, days, current_block // BLOCKS_PER_DAY)
+        if _etag_matches(request.headers.get('if-none-match'), etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        response.headers['ETag'] = etag
+        response.headers['Cache-Control'] = 'public, max-age=60'
+
         blocks = range(current_block, current_block - total_blocks, -BLOCKS_PER_DAY)
-        
-        # Create tasks for all blocks
-        tasks = [_get_balance_at_block(substrate, coldkey, block) for block in blocks]
-        
-        # Execute all tasks concurrently
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        
-        # Filter out any exceptions and convert results to HistoricalData objects
-        valid_results = [
-            result for result in results 
-            if not isinstance(result, Exception)
-        ]
-        
+        timestamps = _block_timestamps(blocks, current_block)
+
+        if BATCH_RPC:
+            valid_results = await _get_balances_batched(substrate, coldkey, blocks, timestamps)
+        else:
+            # Create tasks for all blocks
+            tasks = [
+                _get_balance_at_block(substrate, coldkey, block, timestamp)
+                for block, timestamp in zip(blocks, timestamps)
+            ]
+
+            # Execute all tasks concurrently
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+
+            # Filter out any exceptions and convert results to HistoricalData objects
+            valid_results = [
+                result for result in results
+                if not isinstance(result, Exception)
+            ]
+
+        # Data is already validated internally, so skip per-field validation
         return [
-            HistoricalData(block_number=block, timestamp=timestamp, value=value)
+            HistoricalData.model_construct(block_number=block, timestamp=timestamp, value=value)
             for block, timestamp, value in valid_results
         ]
 
@@ -93,114 +191,227 @@ async def get_historical_balance(
 @router.get("/stake/{coldkey}", response_model=List[HistoricalData])
 async def get_historical_stake(
     coldkey: str,
+    request: Request,
+    response: Response,
     days: int = Query(default=7, description="Number of days to look back"),
     subtensor_manager: SubtensorManager = Depends(get_subtensor_manager)
 ) -> List[HistoricalData]:
     total_blocks = days * BLOCKS_PER_DAY
-    
+
     async with subtensor_manager.get_subtensor() as substrate:
         current_block = await substrate.get_block_number()
+
+        # Answer unchanged polls with a 304 before doing the fan-out
+        etag = _make_etag(coldkey, days, current_block // BLOCKS_PER_DAY)
+        if _etag_matches(request.headers.get('if-none-match'), etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        response.headers['ETag'] = etag
+        response.headers['Cache-Control'] = 'public, max-age=60'
+
         blocks = range(current_block, current_block - total_blocks, -BLOCKS_PER_DAY)
         
-        # Execute tasks sequentially
-        results = []
-        for block in blocks:
-            try:
-                result = await _get_stake_at_block(substrate, coldkey, block)
-                results.append(result)
-            except Exception as e:
-                print(f"Error getting stake for block {block}: {e}")
-                continue
-        
-        # Convert results to HistoricalData objects
+        # Create tasks for all blocks
+        timestamps = _block_timestamps(blocks, current_block)
+        tasks = [
+            _get_stake_at_block(substrate, coldkey, block, timestamp)
+            for block, timestamp in zip(blocks, timestamps)
+        ]
+
+        # Execute all tasks concurrently
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+        # Filter out any exceptions and convert results to HistoricalData objects
+        valid_results = [
+            result for result in results
+            if not isinstance(result, Exception)
+        ]
+
+        # Data is already validated internally, so skip per-field validation
         return [
-            HistoricalData(block_number=block, timestamp=timestamp, value=value)
-            for block, timestamp, value in results
+            HistoricalData.model_construct(block_number=block, timestamp=timestamp, value=value)
+            for block, timestamp, value in valid_results
         ]
 
 
-@router.get("/balance-history/{coldkey}", response_model=List[DailyData])
-async def get_combined_data(
-    coldkey: str,
-    days: int = Query(default=7, description="Number of days to look back"),
-    subtensor_manager: SubtensorManager = Depends(get_subtensor_manager)
-) -> List[DailyData]:
+async def _fetch_combined_data(subtensor_manager: SubtensorManager, coldkey: str, days: int) -> List[DailyData]:
     total_blocks = days * BLOCKS_PER_DAY
     
     async with subtensor_manager.get_subtensor() as substrate:
         current_block = await substrate.get_block_number()
         blocks = range(current_block, current_block - total_blocks, -BLOCKS_PER_DAY)
         
-        # Get balance data concurrently
-        balance_tasks = [_get_balance_at_block(substrate, coldkey, block) for block in blocks]
-        balance_results = await asyncio.gather(*balance_tasks, return_exceptions=True)
-        valid_balance_results = [
-            result for result in balance_results 
-            if not isinstance(result, Exception)
-        ]
-        
-        # Get stake data sequentially
-        stake_results = []
-        for block in blocks:
-            try:
-                result = await _get_stake_at_block(substrate, coldkey, block)
-                stake_results.append(result)
-            except Exception as e:
-                print(f"Error getting stake for block {block}: {e}")
-                continue
-        
-        # Group data by date
-        daily_data: Dict[datetime, Dict[str, float]] = defaultdict(lambda: {"balance": 0.0, "stake": 0.0})
+        timestamps = _block_timestamps(blocks, current_block)
+
+        if BATCH_RPC:
+            # Stake comes from a runtime API, so only the balances can be batched
+            valid_balance_results, stake_results_raw = await asyncio.gather(
+                _get_balances_batched(substrate, coldkey, blocks, timestamps),
+                asyncio.gather(
+                    *[
+                        _get_stake_at_block(substrate, coldkey, block, timestamp)
+                        for block, timestamp in zip(blocks, timestamps)
+                    ],
+                    return_exceptions=True
+                )
+            )
+            stake_results = [
+                result for result in stake_results_raw
+                if not isinstance(result, Exception)
+            ]
+        else:
+            # Get balance and stake data in a single concurrent fan-out
+            tasks = [
+                _get_balance_at_block(substrate, coldkey, block, timestamp)
+                for block, timestamp in zip(blocks, timestamps)
+            ]
+            tasks += [
+                _get_stake_at_block(substrate, coldkey, block, timestamp)
+                for block, timestamp in zip(blocks, timestamps)
+            ]
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+
+            n = len(blocks)
+            valid_balance_results = [
+                result for result in results[:n]
+                if not isinstance(result, Exception)
+            ]
+            stake_results = [
+                result for result in results[n:]
+                if not isinstance(result, Exception)
+            ]
         
+        # Group data by calendar day; date objects are cheaper keys than
+        # midnight datetimes
+        daily_data: Dict[date, Dict[str, float]] = {}
+
         # Process balance results
         for block, timestamp, value in valid_balance_results:
-            date = timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
-            daily_data[date]["balance"] = value
-        
+            daily_data.setdefault(timestamp.date(), {"balance": 0.0, "stake": 0.0})["balance"] = value
+
         # Process stake results
         for block, timestamp, value in stake_results:
-            date = timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
-            daily_data[date]["stake"] = value
-        
+            daily_data.setdefault(timestamp.date(), {"balance": 0.0, "stake": 0.0})["stake"] = value
+
         # Convert to list and sort by date
         return [
-            DailyData(
-                date=date,
+            DailyData.model_construct(
+                date=datetime.combine(day, time.min),
                 balance=data["balance"],
                 stake=data["stake"]
             )
-            for date, data in sorted(daily_data.items())
+            for day, data in sorted(daily_data.items())
         ]
 
 
+@router.get("/balance-history/{coldkey}", response_model=List[DailyData])
+async def get_combined_data(
+    coldkey: str,
+    request: Request,
+    response: Response,
+    days: int = Query(default=7, description="Number of days to look back"),
+    subtensor_manager: SubtensorManager = Depends(get_subtensor_manager)
+) -> List[DailyData]:
+    data = await _fetch_combined_data(subtensor_manager, coldkey, days)
+
+    if data:
+        etag = _make_etag(coldkey, days, data[-1].date.date())
+        if _etag_matches(request.headers.get('if-none-match'), etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        response.headers['ETag'] = etag
+        response.headers['Cache-Control'] = 'public, max-age=60'
+
+    return data
+
+
 @router.get("/chart/{coldkey}")
 async def get_chart(
     coldkey: str,
+    request: Request,
     days: int = Query(default=7, description="Number of days to look back"),
     subtensor_manager: SubtensorManager = Depends(get_subtensor_manager)
 ) -> StreamingResponse:
+    # WebP cuts the payload roughly 4x for clients that accept it
+    image_format = 'webp' if 'image/webp' in request.headers.get('accept', '') else 'png'
+
+    # Serve a recently rendered chart straight from the cache
+    cache_key = (coldkey, days, image_format)
+    cached = _CHART_CACHE.get(cache_key)
+    if cached is not None:
+        image, etag = cached
+        if _etag_matches(request.headers.get('if-none-match'), etag):
+            return Response(status_code=304, headers={"ETag": etag})
+        return StreamingResponse(
+            io.BytesIO(image),
+            media_type=f"image/{image_format}",
+            headers={"Cache-Control": f"public, max-age={CHART_CACHE_TTL}", "ETag": etag}
+        )
+
     # Get the historical data
-    data = await get_combined_data(coldkey, days, subtensor_manager)
-    
+    data = await _fetch_combined_data(subtensor_manager, coldkey, days)
+
     if not data:
         return Response(status_code=404, content="No data available for the specified period")
-    
-    # Create figure with extra space at bottom for legend and sync date
-    fig = plt.figure(figsize=(12, 7.5), facecolor='#1a1a1a')
-    
-    # Create main axis for the chart
-    ax = plt.subplot2grid((12, 1), (0, 0), rowspan=10, fig=fig)
+
+    # Answer unchanged polls with a 304 before rendering
+    etag = _make_etag(coldkey, days, data[-1].date.date())
+    if _etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    # Render off the event loop so matplotlib doesn't block other requests
+    image = await asyncio.to_thread(_render_chart, data, coldkey, image_format)
+
+    # Cache the rendered image and return it
+    _CHART_CACHE[cache_key] = (image, etag)
+
+    return StreamingResponse(
+        io.BytesIO(image),
+        media_type=f"image/{image_format}",
+        headers={"Cache-Control": f"public, max-age={CHART_CACHE_TTL}", "ETag": etag}
+    )
+
+
+# Figure and axes reused across renders; building them is the expensive part
+# of a chart. Rendering serializes on the lock since Agg isn't thread-safe.
+_RENDER_LOCK = threading.Lock()
+_FIG = None
+_AX = None
+_FOOTER_AX = None
+
+
+def _get_figure():
+    global _FIG, _AX, _FOOTER_AX
+    if _FIG is None:
+        # Create figure with extra space at bottom for legend and sync date
+        _FIG = plt.figure(figsize=(12, 7.5), facecolor='#1a1a1a')
+        _AX = plt.subplot2grid((12, 1), (0, 0), rowspan=10, fig=_FIG)
+        _FOOTER_AX = plt.subplot2grid((12, 1), (10, 0), rowspan=2, fig=_FIG)
+    return _FIG, _AX, _FOOTER_AX
+
+
+def _render_chart(data: List[DailyData], coldkey: str, image_format: str = 'png') -> bytes:
+    with _RENDER_LOCK:
+        return _render_chart_locked(data, coldkey, image_format)
+
+
+def _render_chart_locked(data: List[DailyData], coldkey: str, image_format: str) -> bytes:
+    fig, ax, footer_ax = _get_figure()
+
+    # Clear out whatever the previous request plotted
+    ax.cla()
+    footer_ax.cla()
     ax.set_facecolor('#1a1a1a')
-    
+
     # Add title with custom styling and shortened address
     title = f"Balance of {shorten_address(coldkey)}"
     ax.set_title(title, pad=20, color='#ffffff', fontsize=14, fontweight='bold')
     
-    # Plot balance and stake
+    # Plot balance and stake; arrays go into matplotlib without a
+    # list-to-array conversion and the total becomes one vector add
+    n = len(data)
     dates = [d.date for d in data]
-    balances = [d.balance for d in data]
-    stakes = [d.stake for d in data]
-    totals = [b + s for b, s in zip(balances, stakes)]
+    balances = np.fromiter((d.balance for d in data), dtype=np.float64, count=n)
+    stakes = np.fromiter((d.stake for d in data), dtype=np.float64, count=n)
+    totals = balances + stakes
     
     # Plot lines with gradients
     balance_line = ax.plot(dates, balances, label='Free', marker='o', color='#ff4444', linewidth=2, markersize=6)
@@ -218,16 +429,14 @@ async def get_chart(
     
     # Format dates on x-axis
     ax.xaxis.set_major_formatter(mdates.DateFormatter('%d %b'))
-    plt.xticks(rotation=0)
-    
+
     # Add labels with custom styling
     ax.set_ylabel('Amount (τ)', color='#999999', fontsize=10)
     
     # Customize tick labels
     ax.tick_params(colors='#999999', grid_alpha=0.3)
     
-    # Create a new axis for legend and sync date
-    footer_ax = plt.subplot2grid((12, 1), (10, 0), rowspan=2, fig=fig)
+    # Footer axis only holds the legend and sync date
     footer_ax.axis('off')
     
     # Add legend
@@ -292,15 +501,12 @@ async def get_chart(
         )
     
     # Adjust layout
-    plt.subplots_adjust(bottom=0.2, top=0.95, left=0.1, right=0.95)
-    
+    fig.subplots_adjust(bottom=0.2, top=0.95, left=0.1, right=0.95)
+
     # Save the chart to a bytes buffer
     buf = io.BytesIO()
-    plt.savefig(buf, format='png', dpi=300, bbox_inches='tight', facecolor='#1a1a1a')
-    plt.close()
-    
-    # Reset buffer position
-    buf.seek(0)
-    
-    # Return the image
-    return StreamingResponse(buf, media_type="image/png") 
\ No newline at end of file
+    # dpi=120 stays readable on high-density displays at a quarter of the
+    # rasterization cost of dpi=300
+    fig.savefig(buf, format=image_format, dpi=120, bbox_inches='tight', facecolor='#1a1a1a')
+
+    return buf.getvalue()
\ No newline at end of file
@@ -1,12 +1,23 @@
+import asyncio
+import itertools
 import os
 from contextlib import asynccontextmanager
-from typing import Optional, AsyncGenerator
+from typing import List, Optional
 from async_substrate_interface import AsyncSubstrateInterface
+from fastapi import Request
+
+POOL_SIZE = int(os.getenv("SUBTENSOR_POOL_SIZE", "4"))
 
 
 class SubtensorManager:
     def __init__(self):
-        self._substrate: Optional[AsyncSubstrateInterface] = None
+        # Pool of substrate connections, filled lazily; slots are handed out
+        # round-robin so concurrent requests don't queue on one websocket
+        self._pool: List[Optional[AsyncSubstrateInterface]] = [None] * POOL_SIZE
+        # One lock per slot so concurrent requests don't race to fill the
+        # same slot and leak the loser's connection
+        self._locks = [asyncio.Lock() for _ in range(POOL_SIZE)]
+        self._rr = itertools.count()
         self._network = os.getenv("SUBTENSOR_NETWORK", "archive")
         self._url = os.getenv("SUBTENSOR_URL", "wss://archive.chain.opentensor.ai:443")
 
@@ -20,46 +31,50 @@ class SubtensorManager:
         await substrate.initialize()
         return substrate
 
+    async def _get_slot(self, slot: int) -> AsyncSubstrateInterface:
+        async with self._locks[slot]:
+            if self._pool[slot] is None:
+                self._pool[slot] = await self._create_substrate()
+            return self._pool[slot]
+
     @asynccontextmanager
     async def get_subtensor(self):
-        """Get a substrate instance, creating a new one if needed or if the current one is disconnected."""
-        substrate = None
+        """Get a pooled substrate instance, recreating the slot if its connection has failed."""
+        slot = next(self._rr) % len(self._pool)
+        try:
+            substrate = await self._get_slot(slot)
+        except Exception:
+            # Connection setup failed before anything was handed out, so it
+            # is safe to retry the slot once
+            substrate = await self._get_slot(slot)
         try:
-            if self._substrate is None:
-                self._substrate = await self._create_substrate()
-            substrate = self._substrate
             yield substrate
         except Exception:
-            # For any error, close the current instance and create a new one
-            if self._substrate is not None:
+            # The connection misbehaved mid-use; retire it so the next
+            # request gets a fresh one, then surface the original error.
+            # Yielding a replacement here would make the generator yield
+            # twice after athrow, masking the real exception.
+            async with self._locks[slot]:
+                # Another request may have replaced the slot already; only
+                # retire the handle this request actually used
+                if self._pool[slot] is substrate:
+                    self._pool[slot] = None
                 try:
-                    await self._substrate.close()
+                    await substrate.close()
                 except:
                     pass
-                self._substrate = None
-            self._substrate = await self._create_substrate()
-            yield self._substrate
-        finally:
-            # Only close if this is a temporary instance created during error recovery
-            if substrate is not self._substrate:
+            raise
+
+    async def close(self):
+        """Close all pooled substrate instances."""
+        for i, substrate in enumerate(self._pool):
+            if substrate is not None:
                 try:
                     await substrate.close()
                 except:
                     pass
-
-    async def close(self):
-        """Close the current substrate instance if it exists."""
-        if self._substrate is not None:
-            try:
-                await self._substrate.close()
-            except:
-                pass
-            self._substrate = None
+                self._pool[i] = None
 
 
-async def get_subtensor_manager() -> AsyncGenerator[SubtensorManager, None]:
-    manager = SubtensorManager()
-    try:
-        yield manager
-    finally:
-        await manager.close() 
\ No newline at end of file
+def get_subtensor_manager(request: Request) -> SubtensorManager:
+    return request.app.state.subtensor_manager